@@ -0,0 +1,4 @@
+from dotenv import load_dotenv
+
+# Load .env before any submodule reads its settings at import time
+load_dotenv()
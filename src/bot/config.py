@@ -0,0 +1,179 @@
+import json
+import logging
+import os
+import re
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, FrozenSet, List, Optional, Pattern, Tuple, TypeVar
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.ext import ContextTypes, JobQueue
+
+from .paths import CONFIG_PATH
+
+# Seconds between checks of ``config.json`` for changes
+CONFIG_RELOAD_INTERVAL = 30
+# Telegram limits callback data to 64 bytes
+CALLBACK_DATA_LIMIT = 64
+
+T = TypeVar("T")
+
+
+def chunk(lst: List[T], n: int) -> List[List[T]]:
+    """Split ``lst`` into sublists of length ``n``."""
+    return [lst[i : i + n] for i in range(0, len(lst), n)]
+
+
+@dataclass(frozen=True)
+class BotConfig:
+    """Validated ``config.json`` contents plus assets derived from them."""
+
+    topics: Tuple[str, ...]
+    cefr_levels: Tuple[str, ...]
+    languages: Dict[str, str]
+    language_values: FrozenSet[str]
+    level_values: FrozenSet[str]
+    language_pattern: Pattern[str]
+    level_pattern: Pattern[str]
+    language_keyboard: InlineKeyboardMarkup
+    level_keyboard: InlineKeyboardMarkup
+
+
+def _validate(raw: Any) -> None:
+    """Raise ``ValueError`` if ``raw`` is not a usable bot configuration."""
+    if not isinstance(raw, dict):
+        raise ValueError("config root must be an object")
+    topics = raw.get("topics")
+    if not isinstance(topics, list) or not topics:
+        raise ValueError("'topics' must be a non-empty list")
+    if not all(isinstance(t, str) and t for t in topics):
+        raise ValueError("'topics' must only contain non-empty strings")
+    levels = raw.get("cefr_levels")
+    if not isinstance(levels, list) or not levels:
+        raise ValueError("'cefr_levels' must be a non-empty list")
+    if not all(isinstance(lv, str) and lv for lv in levels):
+        raise ValueError("'cefr_levels' must only contain non-empty strings")
+    for level in levels:
+        # Levels are sent as callback data too
+        if len(level.encode("utf-8")) > CALLBACK_DATA_LIMIT:
+            raise ValueError(f"level {level!r} exceeds {CALLBACK_DATA_LIMIT} bytes")
+    if len(set(levels)) != len(levels):
+        raise ValueError("'cefr_levels' values must be unique")
+    languages = raw.get("languages")
+    if not isinstance(languages, dict) or not languages:
+        raise ValueError("'languages' must be a non-empty object")
+    for label, value in languages.items():
+        if not isinstance(value, str) or not value:
+            raise ValueError(f"language {label!r} must map to a non-empty string")
+        if len(value.encode("utf-8")) > CALLBACK_DATA_LIMIT:
+            raise ValueError(
+                f"language value {value!r} exceeds {CALLBACK_DATA_LIMIT} bytes"
+            )
+    if len(set(languages.values())) != len(languages):
+        raise ValueError("'languages' values must be unique")
+
+
+def _build(raw: Dict[str, Any]) -> BotConfig:
+    """Precompute keyboards, patterns and lookup sets from ``raw``."""
+    languages = dict(raw["languages"])
+    levels = tuple(raw["cefr_levels"])
+    language_kb = [
+        [InlineKeyboardButton(label, callback_data=value) for label, value in row]
+        for row in chunk(list(languages.items()), 3)
+    ]
+    level_kb = [
+        [InlineKeyboardButton(level, callback_data=level) for level in row]
+        for row in chunk(list(levels), 2)
+    ]
+    return BotConfig(
+        topics=tuple(raw["topics"]),
+        cefr_levels=levels,
+        languages=languages,
+        language_values=frozenset(languages.values()),
+        level_values=frozenset(levels),
+        language_pattern=re.compile(
+            f"^({'|'.join(re.escape(v) for v in languages.values())})$"
+        ),
+        level_pattern=re.compile(f"^({'|'.join(re.escape(lv) for lv in levels)})$"),
+        language_keyboard=InlineKeyboardMarkup(language_kb),
+        level_keyboard=InlineKeyboardMarkup(level_kb),
+    )
+
+
+def load_config(path: Path = CONFIG_PATH) -> BotConfig:
+    """Read, validate and precompute the configuration stored at ``path``."""
+    with open(path, "r", encoding="utf-8") as f:
+        raw = json.load(f)
+    _validate(raw)
+    return _build(raw)
+
+
+def _mtime(path: Path) -> Optional[int]:
+    """Return the modification time of ``path`` in nanoseconds, if it exists."""
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+_config_mtime = _mtime(CONFIG_PATH)
+_config = load_config(CONFIG_PATH)
+
+
+def get_config() -> BotConfig:
+    """Return the current configuration snapshot.
+
+    Callers should fetch it once per update and reuse it, so a reload that
+    happens mid-handler cannot mix assets from two config versions.
+    """
+    return _config
+
+
+def reload_config(path: Path = CONFIG_PATH) -> bool:
+    """Reload ``path`` if it changed on disk; return ``True`` if swapped.
+
+    A file that fails to parse or validate is logged and ignored, leaving the
+    previous configuration active.
+    """
+    global _config, _config_mtime
+    mtime = _mtime(path)
+    if mtime is None or mtime == _config_mtime:
+        return False
+    try:
+        new_config = load_config(path)
+    except Exception as e:
+        logging.error(f"Config reload failed, keeping previous config: {e}")
+        _config_mtime = mtime
+        return False
+    # Single reference assignment, so consumers see either old or new assets
+    _config = new_config
+    _config_mtime = mtime
+    logging.info(
+        "Reloaded config: %d language(s), %d level(s), %d topic(s).",
+        len(new_config.languages),
+        len(new_config.cefr_levels),
+        len(new_config.topics),
+    )
+    return True
+
+
+def is_language_choice(data: object) -> bool:
+    """Callback-query pattern matching a configured language value."""
+    return isinstance(data, str) and bool(get_config().language_pattern.match(data))
+
+
+def is_level_choice(data: object) -> bool:
+    """Callback-query pattern matching a configured CEFR level."""
+    return isinstance(data, str) and bool(get_config().level_pattern.match(data))
+
+
+async def _check_config(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Job callback that reloads the config if the file changed."""
+    reload_config()
+
+
+def watch_config(job_queue: JobQueue, interval: float = CONFIG_RELOAD_INTERVAL) -> None:
+    """Poll ``config.json`` every ``interval`` seconds and hot-reload it."""
+    job_queue.run_repeating(
+        _check_config, interval=interval, first=interval, name="config_reload"
+    )
@@ -1,10 +1,14 @@
 import logging
 import sqlite3
+import zlib
+from datetime import datetime
 from typing import Any, Dict, Optional, Tuple, List
 
 from .paths import DB_PATH
+from .tracing import timed
 
 
+@timed("db.log_all_users")
 def log_all_users() -> Optional[int]:
     """Log all user records and return the number of rows."""
     try:
@@ -37,6 +41,7 @@ def log_all_users() -> Optional[int]:
         return None
 
 
+@timed("db.get_user_data")
 def get_user_data(user_id: int) -> Tuple[bool, Optional[Dict[str, Any]]]:
     """Retrieve a user record by ``user_id``."""
     try:
@@ -56,6 +61,7 @@ def get_user_data(user_id: int) -> Tuple[bool, Optional[Dict[str, Any]]]:
         return False, None
 
 
+@timed("db.create_new_user")
 def create_new_user(user_id: int) -> bool:
     """Insert a new user with default values if absent."""
     try:
@@ -81,6 +87,7 @@ def create_new_user(user_id: int) -> bool:
         return False
 
 
+@timed("db.save_new_user")
 def save_new_user(user_data: Tuple[Any, ...]) -> bool:
     """Insert a fully configured user record."""
     try:
@@ -106,6 +113,7 @@ def save_new_user(user_data: Tuple[Any, ...]) -> bool:
         return False
 
 
+@timed("db.update_user")
 def update_user(
     user_id: int,
     language: Optional[str] = None,
@@ -163,14 +171,18 @@ def update_user(
         return False
 
 
+@timed("db.delete_user")
 def delete_user(user_id: int) -> bool:
     """Remove a user record by ``user_id``."""
     try:
         with sqlite3.connect(DB_PATH) as conn:
             cur = conn.cursor()
             cur.execute("DELETE FROM users WHERE user_id = ?", (user_id,))
+            deleted = cur.rowcount
+            cur.execute("DELETE FROM stories WHERE user_id = ?", (user_id,))
+            cur.execute("DELETE FROM dead_letters WHERE user_id = ?", (user_id,))
             conn.commit()
-            if cur.rowcount > 0:
+            if deleted > 0:
                 logging.info(f"Deleted user_id {user_id} successfully.")
                 return True
             else:
@@ -219,3 +231,333 @@ def ensure_paused_column() -> None:
                 logging.info("Added paused column to users table.")
     except Exception as e:
         logging.error(f"Error ensuring paused column: {e}")
+
+
+def ensure_dead_letter_table() -> None:
+    """Create the dead_letters table used to retry failed deliveries."""
+    try:
+        with sqlite3.connect(DB_PATH) as conn:
+            cur = conn.cursor()
+            cur.execute(
+                """
+                CREATE TABLE IF NOT EXISTS dead_letters(
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id INTEGER NOT NULL,
+                    story_text TEXT,
+                    topic TEXT,
+                    error TEXT,
+                    attempts INTEGER DEFAULT 0,
+                    status TEXT DEFAULT 'pending',
+                    created_at TEXT,
+                    next_attempt TEXT
+                )
+                """
+            )
+            cur.execute(
+                """
+                CREATE INDEX IF NOT EXISTS idx_dead_letters_due
+                ON dead_letters(status, next_attempt)
+                """
+            )
+            cur.execute("PRAGMA table_info(dead_letters)")
+            columns = [row[1] for row in cur.fetchall()]
+            if "topic" not in columns:
+                cur.execute("ALTER TABLE dead_letters ADD COLUMN topic TEXT")
+                logging.info("Added topic column to dead_letters table.")
+            # A replay interrupted by a restart may already have reached the
+            # user, so it waits for an explicit /replay instead of a retry
+            cur.execute(
+                "UPDATE dead_letters SET status = 'unconfirmed' "
+                "WHERE status = 'sending'"
+            )
+            conn.commit()
+    except Exception as e:
+        logging.error(f"Error ensuring dead_letters table: {e}")
+
+
+@timed("db.add_dead_letter")
+def add_dead_letter(
+    user_id: int,
+    story_text: Optional[str],
+    error: str,
+    next_attempt: str,
+    topic: Optional[str] = None,
+    status: str = "pending",
+) -> Optional[int]:
+    """Queue a failed delivery and return its id.
+
+    Only ``pending`` entries are retried automatically; ``failed`` and
+    ``unconfirmed`` ones wait for ``/replay``.
+    """
+    try:
+        with sqlite3.connect(DB_PATH) as conn:
+            cur = conn.cursor()
+            cur.execute(
+                """
+                INSERT INTO dead_letters
+                (user_id, story_text, topic, error, attempts, status, created_at,
+                 next_attempt)
+                VALUES (?, ?, ?, ?, 0, ?, ?, ?)
+                """,
+                (
+                    user_id,
+                    story_text,
+                    topic,
+                    error,
+                    status,
+                    datetime.utcnow().isoformat(),
+                    next_attempt,
+                ),
+            )
+            conn.commit()
+            logging.info(f"Queued dead letter {cur.lastrowid} for user_id {user_id}.")
+            return cur.lastrowid
+    except Exception as e:
+        logging.error(f"Error queueing dead letter for user_id {user_id}: {e}")
+        return None
+
+
+@timed("db.get_dead_letter")
+def get_dead_letter(entry_id: int) -> Optional[Dict[str, Any]]:
+    """Retrieve a dead-letter entry by ``entry_id``."""
+    try:
+        with sqlite3.connect(DB_PATH) as conn:
+            conn.row_factory = sqlite3.Row
+            cur = conn.cursor()
+            cur.execute("SELECT * FROM dead_letters WHERE id = ?", (entry_id,))
+            row = cur.fetchone()
+            return dict(row) if row else None
+    except Exception as e:
+        logging.error(f"Error retrieving dead letter {entry_id}: {e}")
+        return None
+
+
+@timed("db.get_dead_letters")
+def get_dead_letters(
+    statuses: Tuple[str, ...] = ("pending", "failed"),
+    due_before: Optional[str] = None,
+    limit: Optional[int] = None,
+) -> Optional[List[Dict[str, Any]]]:
+    """List dead-letter entries with one of ``statuses``, oldest first.
+
+    If ``due_before`` is given only pending entries whose next attempt is at or
+    before that ISO timestamp are returned.
+    """
+    placeholders = ", ".join("?" * len(statuses))
+    db_query = f"SELECT * FROM dead_letters WHERE status IN ({placeholders})"
+    values: List[Any] = list(statuses)
+    if due_before is not None:
+        db_query += " AND next_attempt <= ?"
+        values.append(due_before)
+    db_query += " ORDER BY id"
+    if limit is not None:
+        db_query += " LIMIT ?"
+        values.append(limit)
+    try:
+        with sqlite3.connect(DB_PATH) as conn:
+            conn.row_factory = sqlite3.Row
+            cur = conn.cursor()
+            cur.execute(db_query, values)
+            return [dict(row) for row in cur.fetchall()]
+    except Exception as e:
+        logging.error(f"Error listing dead letters: {e}")
+        return None
+
+
+@timed("db.update_dead_letter")
+def update_dead_letter(
+    entry_id: int,
+    status: Optional[str] = None,
+    attempts: Optional[int] = None,
+    error: Optional[str] = None,
+    next_attempt: Optional[str] = None,
+    story_text: Optional[str] = None,
+    topic: Optional[str] = None,
+) -> bool:
+    """Update fields of a dead-letter entry identified by ``entry_id``."""
+    fields: List[str] = []
+    values: List[Any] = []
+    if status is not None:
+        fields.append("status = ?")
+        values.append(status)
+    if attempts is not None:
+        fields.append("attempts = ?")
+        values.append(attempts)
+    if error is not None:
+        fields.append("error = ?")
+        values.append(error)
+    if next_attempt is not None:
+        fields.append("next_attempt = ?")
+        values.append(next_attempt)
+    if story_text is not None:
+        fields.append("story_text = ?")
+        values.append(story_text)
+    if topic is not None:
+        fields.append("topic = ?")
+        values.append(topic)
+    if not fields:
+        return False  # nothing to update
+    values.append(entry_id)
+    db_query = f"UPDATE dead_letters SET {', '.join(fields)} WHERE id = ?"
+    try:
+        with sqlite3.connect(DB_PATH) as conn:
+            cur = conn.cursor()
+            cur.execute(db_query, values)
+            conn.commit()
+            return cur.rowcount > 0
+    except Exception as e:
+        logging.error(f"Error updating dead letter {entry_id}: {e}")
+        return False
+
+
+@timed("db.claim_dead_letter")
+def claim_dead_letter(entry_id: int) -> bool:
+    """Mark an undelivered entry as ``sending``; return ``True`` if this call won.
+
+    Only one concurrent replay of an entry gets ``True``, so a story is never
+    sent twice by the retry job and ``/replay`` racing each other.
+    """
+    try:
+        with sqlite3.connect(DB_PATH) as conn:
+            cur = conn.cursor()
+            cur.execute(
+                """
+                UPDATE dead_letters SET status = 'sending'
+                WHERE id = ? AND status IN ('pending', 'failed', 'unconfirmed')
+                """,
+                (entry_id,),
+            )
+            conn.commit()
+            return cur.rowcount == 1
+    except Exception as e:
+        logging.error(f"Error claiming dead letter {entry_id}: {e}")
+        return False
+
+
+def ensure_story_archive_table() -> None:
+    """Create the stories table holding compressed delivered stories."""
+    try:
+        with sqlite3.connect(DB_PATH) as conn:
+            cur = conn.cursor()
+            cur.execute(
+                """
+                CREATE TABLE IF NOT EXISTS stories(
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id INTEGER NOT NULL,
+                    sent_at TEXT NOT NULL,
+                    topic TEXT,
+                    language TEXT,
+                    level TEXT,
+                    body BLOB NOT NULL
+                )
+                """
+            )
+            cur.execute(
+                """
+                CREATE INDEX IF NOT EXISTS idx_stories_user_sent
+                ON stories(user_id, sent_at)
+                """
+            )
+            cur.execute(
+                "CREATE INDEX IF NOT EXISTS idx_stories_sent ON stories(sent_at)"
+            )
+            conn.commit()
+    except Exception as e:
+        logging.error(f"Error ensuring stories table: {e}")
+
+
+@timed("db.archive_story")
+def archive_story(
+    user_id: int,
+    story_text: str,
+    sent_at: str,
+    topic: Optional[str] = None,
+    language: Optional[str] = None,
+    level: Optional[str] = None,
+) -> bool:
+    """Store a delivered story zlib-compressed."""
+    body = zlib.compress(story_text.encode("utf-8"), 9)
+    try:
+        with sqlite3.connect(DB_PATH) as conn:
+            cur = conn.cursor()
+            cur.execute(
+                """
+                INSERT INTO stories (user_id, sent_at, topic, language, level, body)
+                VALUES (?, ?, ?, ?, ?, ?)
+                """,
+                (user_id, sent_at, topic, language, level, body),
+            )
+            conn.commit()
+            return True
+    except Exception as e:
+        logging.error(f"Error archiving story for user_id {user_id}: {e}")
+        return False
+
+
+@timed("db.get_archived_story")
+def get_archived_story(user_id: int, offset: int = 0) -> Optional[Dict[str, Any]]:
+    """Return the ``offset``-th most recent archived story for ``user_id``.
+
+    The ``body`` field is decompressed into ``story_text``.
+    """
+    try:
+        with sqlite3.connect(DB_PATH) as conn:
+            conn.row_factory = sqlite3.Row
+            cur = conn.cursor()
+            cur.execute(
+                """
+                SELECT id, user_id, sent_at, topic, language, level, body
+                FROM stories
+                WHERE user_id = ?
+                ORDER BY sent_at DESC
+                LIMIT 1 OFFSET ?
+                """,
+                (user_id, offset),
+            )
+            row = cur.fetchone()
+            if not row:
+                return None
+            story = dict(row)
+            story["story_text"] = zlib.decompress(story.pop("body")).decode("utf-8")
+            return story
+    except Exception as e:
+        logging.error(f"Error retrieving archived story for user_id {user_id}: {e}")
+        return None
+
+
+@timed("db.get_recent_topics")
+def get_recent_topics(user_id: int, limit: int) -> List[str]:
+    """Return the topics of the last ``limit`` archived stories for ``user_id``."""
+    try:
+        with sqlite3.connect(DB_PATH) as conn:
+            cur = conn.cursor()
+            cur.execute(
+                """
+                SELECT topic FROM stories
+                WHERE user_id = ?
+                ORDER BY sent_at DESC
+                LIMIT ?
+                """,
+                (user_id, limit),
+            )
+            return [row[0] for row in cur.fetchall() if row[0]]
+    except Exception as e:
+        logging.error(f"Error retrieving recent topics for user_id {user_id}: {e}")
+        return []
+
+
+@timed("db.purge_archived_stories")
+def purge_archived_stories(before: str) -> Optional[int]:
+    """Delete archived stories sent before the ISO timestamp ``before``."""
+    try:
+        with sqlite3.connect(DB_PATH) as conn:
+            cur = conn.cursor()
+            cur.execute("DELETE FROM stories WHERE sent_at < ?", (before,))
+            conn.commit()
+            logging.info(
+                f"Purged {cur.rowcount} archived stories sent before {before}."
+            )
+            return cur.rowcount
+    except Exception as e:
+        logging.error(f"Error purging archived stories: {e}")
+        return None
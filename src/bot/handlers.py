@@ -1,14 +1,12 @@
 import os
-import json
 import zoneinfo
 from zoneinfo import ZoneInfo
 
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.constants import ParseMode
 from telegram.ext import ContextTypes, ConversationHandler
-from typing import List, TypeVar
 
-from .paths import CONFIG_PATH
+from .config import chunk, get_config
 from .db import (
     log_all_users,
     get_user_data,
@@ -16,26 +14,23 @@ from .db import (
     save_new_user,
     update_user,
     delete_user,
+    get_dead_letter,
+    get_dead_letters,
+    get_archived_story,
 )
-from .scheduler import schedule_story_job
+from .scheduler import schedule_story_job, pause_user, replay_dead_letter
+from .profiler import PROFILE_MAX_SECONDS, send_profile
+from .tracing import traced
 
 
 LANG, LEVEL, TIME, COMPLETE = range(4)
 
-T = TypeVar("T")
-
-def chunk(lst: List[T], n: int) -> List[List[T]]:
-    """Split ``lst`` into sublists of length ``n``."""
-    return [lst[i : i + n] for i in range(0, len(lst), n)]
-
 
 ALL_TIMEZONES = sorted(zoneinfo.available_timezones())
 ADMIN_ID = os.getenv("ADMIN_ID")
 
-with open(CONFIG_PATH) as f:
-    cfg = json.load(f)
-
 
+@traced("handler.start")
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Send a welcome message and setup instructions."""
     await context.bot.send_message(
@@ -54,18 +49,17 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     )
 
 
+@traced("handler.stop")
 async def stop(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Pause daily story delivery for the user."""
     user_id = update.effective_user.id
-    update_user(user_id, paused=1)
-    jobs = context.job_queue.get_jobs_by_name(str(user_id))
-    for job in jobs:
-        job.schedule_removal()
+    pause_user(context.job_queue, user_id)
     await context.bot.send_message(
         chat_id=update.effective_chat.id,
         text="Daily delivery paused. Use /configure to resume.",
     )
 
+@traced("handler.help")
 async def help(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Display available bot commands."""
     await context.bot.send_message(
@@ -75,13 +69,32 @@ async def help(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
             "/start - Introduction and setup instructions\n"
             "/configure - Configure language, level, timezone, and delivery time\n"
             "/stop - Pause daily delivery\n"
+            "/last - Send your latest story again\n"
             "/cancel - Cancel the current setup\n"
             "/help - Show this help message"
         ),
     )
 
 
+@traced("handler.last")
+async def last(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Re-send an archived story; ``/last 2`` sends the one before the latest."""
+    offset = 0
+    if context.args:
+        if not context.args[0].isdigit() or int(context.args[0]) < 1:
+            await update.message.reply_text(
+                "Usage: /last [n], where 1 is the latest story"
+            )
+            return
+        offset = int(context.args[0]) - 1
+    story = get_archived_story(update.effective_user.id, offset)
+    if story is None:
+        await update.message.reply_text("No archived story found.")
+        return
+    await update.message.reply_text(story["story_text"])
+
 
+@traced("handler.message")
 async def message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Echo the sender's ID and message."""
 
@@ -90,6 +103,7 @@ async def message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     text = update.message.text
     await update.message.reply_text(f"Your id: {user_id}, your message: {text}")
 
+@traced("handler.configure")
 async def configure(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Start the configuration flow by asking for the target language."""
     user_id = update.message.from_user.id
@@ -113,16 +127,9 @@ async def configure(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
                 context.user_data["timezone"] = tz
             if hour is not None:
                 context.user_data["delivery_hour"] = hour
-    items = list(cfg["languages"].items())
-    rows = chunk(items, 3)
-    kb = [
-        [InlineKeyboardButton(lang[0], callback_data=f"{lang[1]}") for lang in row]
-        for row in rows
-    ]
-
     await update.message.reply_text(
         f"{note}Hey there!\nPlease select the name of the language that you want to study or select /cancel to abort.\n",
-        reply_markup=InlineKeyboardMarkup(kb),
+        reply_markup=get_config().language_keyboard,
     )
 
     return LANG
@@ -131,31 +138,31 @@ async def configure(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
 
 
 
+@traced("handler.lang_handler")
 async def lang_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Store the chosen language and prompt for proficiency level."""
     query = update.callback_query
     language = query.data
-    if language not in cfg["languages"].values():
+    cfg = get_config()
+    if language not in cfg.language_values:
         await query.answer("Please use the buttons")
         return LANG
     await query.answer()
     context.user_data["language"] = language
     update_user(query.from_user.id, language=language)
-    levels = cfg["cefr_levels"]
-    rows = chunk(levels, 2)
-    kb = [[InlineKeyboardButton(level, callback_data=f"{level}") for level in row] for row in rows]
     await query.edit_message_text(
         text=f"You chose {language}.\nNow select a level or type /cancel to abort",
-        reply_markup=InlineKeyboardMarkup(kb),
+        reply_markup=cfg.level_keyboard,
     )
     return LEVEL
 
 
+@traced("handler.level_handler")
 async def level_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Record the user's level and proceed to timezone configuration."""
     query = update.callback_query
     level = query.data
-    if level not in cfg["cefr_levels"]:
+    if level not in get_config().level_values:
         await query.answer("Please use the buttons")
         return LEVEL
     await query.answer()
@@ -184,6 +191,7 @@ async def level_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> i
     return TIME
 
 
+@traced("handler.time_handler")
 async def time_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Handle timezone selection and delivery hour input."""
     text = update.message.text.strip()
@@ -234,6 +242,7 @@ async def time_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> in
     # Should not reach here if both timezone and delivery hour are present
     return COMPLETE
 
+@traced("handler.timezone_button_handler")
 async def timezone_button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Store selected timezone and ask for delivery hour."""
     query = update.callback_query
@@ -252,6 +261,7 @@ async def timezone_button_handler(update: Update, context: ContextTypes.DEFAULT_
 
 
 
+@traced("handler.complete_handler")
 async def complete_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Finalize configuration or cancel based on user choice."""
     query = update.callback_query
@@ -289,6 +299,7 @@ async def complete_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -
     return ConversationHandler.END
 
 
+@traced("handler.cancel")
 async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Abort the current configuration conversation."""
     await update.message.reply_text("Setup cancelled.")
@@ -297,6 +308,7 @@ async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
 
 
 
+@traced("handler.log_db_cmd")
 async def log_db_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Log all users to the server logs."""
     if ADMIN_ID is None or str(update.effective_user.id) != ADMIN_ID:
@@ -309,6 +321,7 @@ async def log_db_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None
         await update.message.reply_text(f"Logged {n} row(s) to server logs.")
 
 
+@traced("handler.delete_user_cmd")
 async def delete_user_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Delete a user by ID. Only available to the admin."""
     if ADMIN_ID is None or str(update.effective_user.id) != ADMIN_ID:
@@ -330,3 +343,85 @@ async def delete_user_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         await update.message.reply_text(f"User {target_id} deleted")
     else:
         await update.message.reply_text(f"User {target_id} not found")
+
+
+@traced("handler.dead_letters_cmd")
+async def dead_letters_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """List queued, failed and unconfirmed deliveries. Only available to the admin."""
+    if ADMIN_ID is None or str(update.effective_user.id) != ADMIN_ID:
+        await update.message.reply_text("Unauthorized")
+        return
+    entries = get_dead_letters(("pending", "failed", "unconfirmed"), limit=20)
+    if entries is None:
+        await update.message.reply_text("Dead-letter lookup failed. Check server logs.")
+        return
+    if not entries:
+        await update.message.reply_text("Dead-letter queue is empty.")
+        return
+    lines = [
+        f"#{e['id']} user {e['user_id']} | {e['status']} | attempts={e['attempts']} | "
+        f"next={e['next_attempt']} | {e['error']}"
+        for e in entries
+    ]
+    await update.message.reply_text(
+        "\n".join(lines) + "\nUse /replay <id|all> to retry now."
+    )
+
+
+@traced("handler.replay_cmd")
+async def replay_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Retry dead-letter deliveries immediately. Only available to the admin."""
+    if ADMIN_ID is None or str(update.effective_user.id) != ADMIN_ID:
+        await update.message.reply_text("Unauthorized")
+        return
+    if not context.args:
+        await update.message.reply_text("Usage: /replay <id|all>")
+        return
+    if context.args[0] == "all":
+        # Unconfirmed entries may already have reached the user; replay by id
+        entries = get_dead_letters() or []
+    else:
+        try:
+            entry = get_dead_letter(int(context.args[0]))
+        except ValueError:
+            await update.message.reply_text("Invalid dead-letter id")
+            return
+        if entry is None or entry["status"] == "delivered":
+            await update.message.reply_text(f"No undelivered entry {context.args[0]}")
+            return
+        entries = [entry]
+    delivered = 0
+    for entry in entries:
+        if await replay_dead_letter(context, entry):
+            delivered += 1
+    await update.message.reply_text(f"Delivered {delivered} of {len(entries)} entries.")
+
+
+@traced("handler.profile_cmd")
+async def profile_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Profile the running bot for a few seconds. Only available to the admin."""
+    if ADMIN_ID is None or str(update.effective_user.id) != ADMIN_ID:
+        await update.message.reply_text("Unauthorized")
+        return
+    if not context.args:
+        await update.message.reply_text("Usage: /profile <seconds>")
+        return
+    try:
+        seconds = float(context.args[0])
+    except ValueError:
+        await update.message.reply_text("Invalid number of seconds")
+        return
+    if not 0 < seconds <= PROFILE_MAX_SECONDS:
+        await update.message.reply_text(
+            f"Seconds must be between 0 and {PROFILE_MAX_SECONDS}."
+        )
+        return
+    # Run as a job so this update doesn't hold up others while sampling
+    context.job_queue.run_once(
+        send_profile,
+        when=0,
+        chat_id=update.effective_chat.id,
+        data={"seconds": seconds},
+        name="profile",
+    )
+    await update.message.reply_text(f"Profiling for {seconds:g}s...")
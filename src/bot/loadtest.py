@@ -0,0 +1,501 @@
+"""Load-test harness for the ``/configure`` conversation.
+
+Drives simulated users through the full setup flow by feeding synthetic
+``Update`` objects into a real :class:`~telegram.ext.Application` whose Bot API
+calls go to a local fake server. Run from ``src/``::
+
+    python -m bot.loadtest --users 2000 --concurrency 500
+
+``--compare`` runs the same traffic with sequential update processing and
+with :class:`~bot.update_processor.ChatOrderedUpdateProcessor` and reports
+the throughput gain.
+
+The database and trace files are written to a temporary ``DATA_DIR`` so the
+production data store is never touched.
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+import urllib.parse
+from collections import defaultdict
+from datetime import datetime
+from time import perf_counter
+from typing import Any, Dict, List, Optional, Set, Tuple
+from zoneinfo import ZoneInfo
+
+from telegram import Update
+from telegram.ext import Application
+
+from .update_processor import MAX_CONCURRENT_UPDATES, ChatOrderedUpdateProcessor
+
+LOADTEST_TOKEN = "123456:LOADTEST"
+LOADTEST_TIMEZONE = "Europe/Berlin"
+# Bot API methods that conclude a conversation step
+REPLY_METHODS = {"sendMessage", "editMessageText"}
+
+
+class FakeBotAPI:
+    """Minimal Bot API stand-in served from its own thread and event loop.
+
+    Every call is acknowledged; ``sendMessage`` and ``editMessageText`` also
+    resolve the future registered for that chat with :meth:`expect`, which is
+    how the harness knows a handler has replied.
+    """
+
+    def __init__(self, latency: float = 0.0) -> None:
+        self.latency = latency
+        self.calls: Dict[str, int] = defaultdict(int)
+        self._waiters: Dict[int, asyncio.Future] = {}
+        self._message_ids = itertools.count(1)
+        self._client_loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._thread: Optional[threading.Thread] = None
+        self._ready = threading.Event()
+        self._writers: Set[asyncio.StreamWriter] = set()
+        self.port = 0
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.port}/bot"
+
+    def start(self) -> None:
+        """Start serving; must be called from the loop that runs the bot."""
+        self._client_loop = asyncio.get_running_loop()
+        self._thread = threading.Thread(
+            target=self._run, name="fake-bot-api", daemon=True
+        )
+        self._thread.start()
+        self._ready.wait()
+
+    def stop(self) -> None:
+        if self._loop is not None:
+            asyncio.run_coroutine_threadsafe(self._shutdown(), self._loop).result(
+                timeout=5
+            )
+            self._loop.call_soon_threadsafe(self._loop.stop)
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+    async def _shutdown(self) -> None:
+        """Close the listener and any keep-alive connections still open."""
+        if self._server is not None:
+            self._server.close()
+        for writer in list(self._writers):
+            writer.close()
+        tasks = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def expect(self, chat_id: int) -> asyncio.Future:
+        """Return a future resolved by the next reply sent to ``chat_id``."""
+        assert self._client_loop is not None
+        future = self._client_loop.create_future()
+        self._waiters[chat_id] = future
+        return future
+
+    def _resolve(self, chat_id: int, method: str) -> None:
+        future = self._waiters.pop(chat_id, None)
+        if future is not None and not future.done():
+            future.set_result(method)
+
+    def _run(self) -> None:
+        self._loop = asyncio.new_event_loop()
+        self._server = self._loop.run_until_complete(
+            asyncio.start_server(self._handle, "127.0.0.1", 0, backlog=1024)
+        )
+        self.port = self._server.sockets[0].getsockname()[1]
+        self._ready.set()
+        self._loop.run_forever()
+        self._loop.close()
+
+    async def _handle(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        self._writers.add(writer)
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                _, target, _ = request_line.decode("latin-1").split(" ", 2)
+                headers: Dict[str, str] = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    key, value = line.decode("latin-1").split(":", 1)
+                    headers[key.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+                if self.latency:
+                    await asyncio.sleep(self.latency)
+                method = target.rsplit("/", 1)[-1]
+                result = self._respond(method, _parse_body(headers, body))
+                data = json.dumps({"ok": True, "result": result}).encode("utf-8")
+                writer.write(
+                    b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n"
+                    b"Content-Length: %d\r\n\r\n" % len(data) + data
+                )
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self._writers.discard(writer)
+            writer.close()
+
+    def _respond(self, method: str, params: Dict[str, Any]) -> Any:
+        self.calls[method] += 1
+        if method == "getMe":
+            return {
+                "id": 1,
+                "is_bot": True,
+                "first_name": "LoadTest",
+                "username": "loadtest_bot",
+            }
+        if method not in REPLY_METHODS:
+            return True
+        chat_id = int(params.get("chat_id", 0))
+        assert self._client_loop is not None
+        self._client_loop.call_soon_threadsafe(self._resolve, chat_id, method)
+        return {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "text": params.get("text", ""),
+        }
+
+
+def _parse_body(headers: Dict[str, str], body: bytes) -> Dict[str, Any]:
+    """Decode a form-encoded or JSON Bot API request body."""
+    if not body:
+        return {}
+    if headers.get("content-type", "").startswith("application/json"):
+        return json.loads(body)
+    return {k: v[0] for k, v in urllib.parse.parse_qs(body.decode("utf-8")).items()}
+
+
+_update_ids = itertools.count(1)
+
+
+def _user(user_id: int) -> Dict[str, Any]:
+    return {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"}
+
+
+def _message_update(user_id: int, text: str) -> Dict[str, Any]:
+    message: Dict[str, Any] = {
+        "message_id": next(_update_ids),
+        "date": int(time.time()),
+        "chat": {"id": user_id, "type": "private"},
+        "from": _user(user_id),
+        "text": text,
+    }
+    if text.startswith("/"):
+        message["entities"] = [
+            {"type": "bot_command", "offset": 0, "length": len(text)}
+        ]
+    return {"update_id": next(_update_ids), "message": message}
+
+
+def _callback_update(user_id: int, data: str) -> Dict[str, Any]:
+    return {
+        "update_id": next(_update_ids),
+        "callback_query": {
+            "id": str(next(_update_ids)),
+            "from": _user(user_id),
+            "chat_instance": str(user_id),
+            "data": data,
+            "message": {
+                "message_id": 1,
+                "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private"},
+                "text": "",
+            },
+        },
+    }
+
+
+def configure_steps(
+    user_id: int, language: str, level: str, hour: int
+) -> List[Tuple[str, Dict[str, Any]]]:
+    """Return the named updates a new user sends to complete ``/configure``."""
+    return [
+        ("configure", _message_update(user_id, "/configure")),
+        ("lang_handler", _callback_update(user_id, language)),
+        ("level_handler", _callback_update(user_id, level)),
+        (
+            "time_handler.search",
+            _message_update(user_id, LOADTEST_TIMEZONE.split("/")[1]),
+        ),
+        ("timezone_button_handler", _callback_update(user_id, LOADTEST_TIMEZONE)),
+        ("time_handler.hour", _message_update(user_id, str(hour))),
+        ("complete_handler", _callback_update(user_id, "ok")),
+    ]
+
+
+def command_steps(user_id: int) -> List[Tuple[str, Dict[str, Any]]]:
+    """Return a burst of quick commands from an already active user."""
+    return [
+        ("start", _message_update(user_id, "/start")),
+        ("help", _message_update(user_id, "/help")),
+        ("last", _message_update(user_id, "/last")),
+    ]
+
+
+class Stats:
+    """Latency samples and failure counts collected during a run."""
+
+    def __init__(self) -> None:
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.failures: Dict[str, int] = defaultdict(int)
+        self.loop_lag: List[float] = []
+        self.completed = 0
+        self.updates = 0
+
+
+async def run_steps(
+    application: Application,
+    api: FakeBotAPI,
+    user_id: int,
+    steps: List[Tuple[str, Dict[str, Any]]],
+    stats: Stats,
+    timeout: float,
+) -> bool:
+    """Feed ``steps`` one at a time, waiting for the bot's reply to each."""
+    for name, data in steps:
+        reply = api.expect(user_id)
+        start = perf_counter()
+        await application.update_queue.put(Update.de_json(data, application.bot))
+        stats.updates += 1
+        try:
+            await asyncio.wait_for(reply, timeout)
+        except asyncio.TimeoutError:
+            stats.failures[name] += 1
+            return False
+        stats.latencies[name].append(perf_counter() - start)
+    return True
+
+
+async def _monitor_loop_lag(stats: Stats, interval: float = 0.01) -> None:
+    """Record how late the event loop wakes a sleeping task."""
+    while True:
+        start = perf_counter()
+        await asyncio.sleep(interval)
+        stats.loop_lag.append(perf_counter() - start - interval)
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """Return the ``pct`` percentile of ``values`` using linear interpolation."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    k = (len(ordered) - 1) * pct / 100
+    lower = int(k)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (k - lower)
+
+
+def summarize(stats: Stats, elapsed: float, users: int) -> Dict[str, Any]:
+    """Build the report as a JSON-serialisable dict (times in milliseconds)."""
+
+    def dist(values: List[float]) -> Dict[str, float]:
+        return {
+            "count": len(values),
+            "p50": round(percentile(values, 50) * 1000, 2),
+            "p90": round(percentile(values, 90) * 1000, 2),
+            "p99": round(percentile(values, 99) * 1000, 2),
+            "max": round(max(values, default=0.0) * 1000, 2),
+        }
+
+    return {
+        "users": users,
+        "completed": stats.completed,
+        "failures": dict(stats.failures),
+        "elapsed_s": round(elapsed, 3),
+        "conversations_per_s": round(stats.completed / elapsed, 2) if elapsed else 0.0,
+        "updates_per_s": round(stats.updates / elapsed, 2) if elapsed else 0.0,
+        "steps": {name: dist(values) for name, values in stats.latencies.items()},
+        "loop_lag": dist(stats.loop_lag),
+    }
+
+
+def print_report(report: Dict[str, Any]) -> None:
+    print(f"\n== concurrent updates: {report['concurrent_updates']}")
+    print(
+        f"{report['completed']}/{report['users']} conversations in {report['elapsed_s']}s "
+        f"({report['conversations_per_s']} conv/s, {report['updates_per_s']} updates/s)"
+    )
+    if report["failures"]:
+        print(f"Timed out: {report['failures']}")
+    print(
+        f"\n{'step':<26}{'count':>8}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}{'max ms':>10}"
+    )
+    rows = list(report["steps"].items()) + [("event loop lag", report["loop_lag"])]
+    for name, d in rows:
+        print(
+            f"{name:<26}{d['count']:>8}{d['p50']:>10}{d['p90']:>10}{d['p99']:>10}{d['max']:>10}"
+        )
+
+
+async def run(
+    args: argparse.Namespace, concurrent_updates: int, first_user_id: int
+) -> Dict[str, Any]:
+    """Run one load test and return its report."""
+    # Deferred so DATA_DIR and the API keys are set before bot modules load
+    from .config import get_config
+    from .main import register_handlers
+    from .tracing import TracedRequest
+
+    from telegram.ext import ApplicationBuilder
+
+    logging.getLogger().setLevel(args.log_level)
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    api = FakeBotAPI(latency=args.api_latency)
+    api.start()
+    application = (
+        ApplicationBuilder()
+        .token(LOADTEST_TOKEN)
+        .base_url(api.base_url)
+        .request(TracedRequest(connection_pool_size=256))
+        .concurrent_updates(ChatOrderedUpdateProcessor(concurrent_updates))
+        .build()
+    )
+    register_handlers(application)
+
+    cfg = get_config()
+    languages = sorted(cfg.language_values)
+    # Pick a delivery hour far from now so no story job fires during the run
+    hour = (datetime.now(ZoneInfo(LOADTEST_TIMEZONE)).hour + 12) % 24
+    stats = Stats()
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def simulate(index: int) -> None:
+        if args.ramp:
+            await asyncio.sleep(args.ramp * index / args.users)
+        user_id = first_user_id + index
+        if index % 100 < args.mixed * 100:
+            steps = command_steps(user_id)
+        else:
+            steps = configure_steps(
+                user_id,
+                languages[index % len(languages)],
+                cfg.cefr_levels[index % len(cfg.cefr_levels)],
+                hour,
+            )
+        async with semaphore:
+            if await run_steps(application, api, user_id, steps, stats, args.timeout):
+                stats.completed += 1
+
+    try:
+        async with application:
+            await application.start()
+            monitor = asyncio.create_task(_monitor_loop_lag(stats))
+            start = perf_counter()
+            await asyncio.gather(*(simulate(i) for i in range(args.users)))
+            elapsed = perf_counter() - start
+            monitor.cancel()
+            await application.stop()
+    finally:
+        api.stop()
+    report = summarize(stats, elapsed, args.users)
+    report["concurrent_updates"] = concurrent_updates
+    return report
+
+
+async def run_all(args: argparse.Namespace) -> List[Dict[str, Any]]:
+    """Run the requested load test, twice with ``--compare``."""
+    settings = (
+        [1, args.concurrent_updates] if args.compare else [args.concurrent_updates]
+    )
+    reports = []
+    for i, concurrent_updates in enumerate(settings):
+        # Fresh user ids so every run starts from unconfigured users
+        first_user_id = args.first_user_id + i * args.users
+        reports.append(await run(args, concurrent_updates, first_user_id))
+    return reports
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=1000, help="simulated users")
+    parser.add_argument(
+        "--concurrency", type=int, default=200, help="users in the conversation at once"
+    )
+    parser.add_argument(
+        "--ramp",
+        type=float,
+        default=0.0,
+        help="seconds over which users arrive (0 = spike)",
+    )
+    parser.add_argument(
+        "--api-latency",
+        type=float,
+        default=0.0,
+        help="seconds the fake Bot API waits per call",
+    )
+    parser.add_argument(
+        "--mixed",
+        type=float,
+        default=0.0,
+        help="fraction of users sending /start, /help and /last instead of /configure",
+    )
+    parser.add_argument(
+        "--concurrent-updates",
+        type=int,
+        default=MAX_CONCURRENT_UPDATES,
+        help="update processor concurrency cap (1 = sequential)",
+    )
+    parser.add_argument(
+        "--compare",
+        action="store_true",
+        help="run sequentially first, then with --concurrent-updates, and compare",
+    )
+    parser.add_argument(
+        "--timeout", type=float, default=60.0, help="per-step timeout in seconds"
+    )
+    parser.add_argument("--first-user-id", type=int, default=10_000_000)
+    parser.add_argument(
+        "--data-dir", help="keep the database and traces here instead of a temp dir"
+    )
+    parser.add_argument(
+        "--json", dest="json_path", help="also write the report to this file"
+    )
+    parser.add_argument("--log-level", default="WARNING")
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    args = build_parser().parse_args(argv)
+    data_dir = args.data_dir or tempfile.mkdtemp(prefix="langbot-loadtest-")
+    os.environ["DATA_DIR"] = data_dir
+    os.environ.setdefault("TELEGRAM_BOT_KEY", LOADTEST_TOKEN)
+    os.environ.setdefault("OPENAI_API_KEY", "loadtest")
+    # Keep load-test traces out of a collector configured in .env
+    os.environ.pop("OTEL_EXPORTER_OTLP_TRACES_ENDPOINT", None)
+    try:
+        reports = asyncio.run(run_all(args))
+    finally:
+        if not args.data_dir:
+            shutil.rmtree(data_dir, ignore_errors=True)
+    for report in reports:
+        print_report(report)
+    if len(reports) == 2 and reports[0]["updates_per_s"]:
+        baseline, concurrent = reports
+        print(
+            f"\nThroughput gain: {concurrent['updates_per_s'] / baseline['updates_per_s']:.2f}x "
+            f"({baseline['updates_per_s']} -> {concurrent['updates_per_s']} updates/s)"
+        )
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump(reports if args.compare else reports[0], f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,11 +2,8 @@ import logging
 import os
 import sqlite3
 
-from dotenv import load_dotenv
-
-
-
 from telegram.ext import (
+    Application,
     ApplicationBuilder,
     CommandHandler,
     MessageHandler,
@@ -16,11 +13,18 @@ from telegram.ext import (
 )
 
 from .paths import DATA_DIR, DB_PATH
-from .db import migrate_last_sent_to_timestamp, ensure_paused_column
+from .config import is_language_choice, is_level_choice, watch_config
+from .db import (
+    migrate_last_sent_to_timestamp,
+    ensure_paused_column,
+    ensure_dead_letter_table,
+    ensure_story_archive_table,
+)
 from .handlers import (
     start,
     stop,
     help,
+    last,
     configure,
     lang_handler,
     level_handler,
@@ -30,17 +34,23 @@ from .handlers import (
     cancel,
     log_db_cmd,
     delete_user_cmd,
+    dead_letters_cmd,
+    replay_cmd,
+    profile_cmd,
 
     LANG,
     LEVEL,
     TIME,
     COMPLETE,
-    cfg,
 )
-from .scheduler import restart_jobs
-
-# Load environment variables before importing modules that rely on them
-load_dotenv()
+from .scheduler import (
+    restart_jobs,
+    schedule_dead_letter_retries,
+    schedule_archive_purge,
+)
+from .profiler import watch_event_loop
+from .tracing import TracedRequest
+from .update_processor import ChatOrderedUpdateProcessor
 
 logging.basicConfig(
     format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO
@@ -75,23 +85,23 @@ cursor.execute(
 conn.close()
 migrate_last_sent_to_timestamp()
 ensure_paused_column()
+ensure_dead_letter_table()
+ensure_story_archive_table()
 
 
-language_pattern = f"^({'|'.join(cfg['languages'].values())})$"
-level_pattern = f"^({'|'.join(cfg['cefr_levels'])})$"
-
-
-if __name__ == "__main__":
-    application = ApplicationBuilder().token(bot_key).build()
-
-
+def register_handlers(application: Application) -> None:
+    """Attach all command and conversation handlers to ``application``."""
     # diagnostics
     application.add_handler(CommandHandler("logdb", log_db_cmd))
+    application.add_handler(CommandHandler("deadletters", dead_letters_cmd))
+    application.add_handler(CommandHandler("replay", replay_cmd))
+    application.add_handler(CommandHandler("profile", profile_cmd))
 
     # command handlers
     application.add_handler(CommandHandler("start", start))
     application.add_handler(CommandHandler("help", help))
     application.add_handler(CommandHandler("stop", stop))
+    application.add_handler(CommandHandler("last", last))
     application.add_handler(CommandHandler("deleteuser", delete_user_cmd))
     # message handler (disabled)
     #application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, message))
@@ -100,8 +110,8 @@ if __name__ == "__main__":
         ConversationHandler(
             entry_points=[CommandHandler("configure", configure)],
             states={
-                LANG: [CallbackQueryHandler(lang_handler, pattern=language_pattern)],
-                LEVEL: [CallbackQueryHandler(level_handler, pattern=level_pattern)],
+                LANG: [CallbackQueryHandler(lang_handler, pattern=is_language_choice)],
+                LEVEL: [CallbackQueryHandler(level_handler, pattern=is_level_choice)],
                 TIME: [
                     MessageHandler(filters.TEXT & ~filters.COMMAND, time_handler),
                     CallbackQueryHandler(timezone_button_handler),
@@ -112,5 +122,20 @@ if __name__ == "__main__":
         )
     )
 
+
+if __name__ == "__main__":
+    application = (
+        ApplicationBuilder()
+        .token(bot_key)
+        .request(TracedRequest(connection_pool_size=256))
+        .concurrent_updates(ChatOrderedUpdateProcessor())
+        .build()
+    )
+    register_handlers(application)
+
     restart_jobs(application.job_queue)
+    schedule_dead_letter_retries(application.job_queue)
+    schedule_archive_purge(application.job_queue)
+    watch_config(application.job_queue)
+    watch_event_loop(application.job_queue)
     application.run_polling()
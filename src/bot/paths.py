@@ -1,7 +1,10 @@
+import os
 from pathlib import Path
 
 BASE_DIR = Path(__file__).resolve().parent
 ROOT_DIR = BASE_DIR.parent
 CONFIG_PATH = BASE_DIR / "config.json"
-DATA_DIR = ROOT_DIR / "data"
+DATA_DIR = Path(os.getenv("DATA_DIR") or ROOT_DIR / "data")
 DB_PATH = DATA_DIR / "users.db"
+TRACE_PATH = DATA_DIR / "traces.jsonl"
+SLOW_DELIVERY_LOG_PATH = DATA_DIR / "slow_deliveries.log"
@@ -0,0 +1,229 @@
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import Counter
+from datetime import datetime
+from types import FrameType
+from typing import Any, Dict, List, Optional, Tuple, cast
+
+from telegram.ext import ContextTypes, JobQueue
+
+# Seconds between stack samples taken by /profile
+PROFILE_INTERVAL = 0.005
+PROFILE_MAX_SECONDS = 300
+PROFILE_TOP_N = 25
+# Log the loop thread's stack if a callback holds the loop this long (seconds)
+DEFAULT_LOOP_BLOCK_THRESHOLD = 0.5
+LOOP_BLOCK_THRESHOLD = float(
+    os.getenv("LOOP_BLOCK_THRESHOLD") or DEFAULT_LOOP_BLOCK_THRESHOLD
+)
+if LOOP_BLOCK_THRESHOLD <= 0:
+    # The watchdog polls every threshold / 4 seconds, so zero would busy-loop
+    logging.warning(
+        "LOOP_BLOCK_THRESHOLD must be positive, using %.1fs.",
+        DEFAULT_LOOP_BLOCK_THRESHOLD,
+    )
+    LOOP_BLOCK_THRESHOLD = DEFAULT_LOOP_BLOCK_THRESHOLD
+
+_profile_lock = threading.Lock()
+
+
+def _frame_label(frame: FrameType) -> str:
+    """Return ``module:function`` for ``frame``."""
+    module = frame.f_globals.get("__name__", "?")
+    return f"{module}:{frame.f_code.co_name}"
+
+
+def _collapse(frame: Optional[FrameType]) -> str:
+    """Return the stack ending at ``frame`` root-first, joined by ``;``."""
+    labels: List[str] = []
+    while frame is not None:
+        labels.append(_frame_label(frame))
+        frame = frame.f_back
+    return ";".join(reversed(labels))
+
+
+class SamplingProfiler:
+    """Periodically sample one thread's stack from a background thread.
+
+    Sampling the event loop thread captures whatever coroutine, job callback
+    or blocking call is running on the loop at each tick, at the cost of one
+    ``sys._current_frames()`` call per interval.
+    """
+
+    def __init__(self, thread_id: int, interval: float = PROFILE_INTERVAL) -> None:
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples: Counter = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> Counter:
+        """Stop sampling and return collapsed stacks with their sample counts."""
+        self._stop.set()
+        self._thread.join()
+        return self.samples
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                self.samples[_collapse(frame)] += 1
+
+
+def format_collapsed(samples: Counter) -> str:
+    """Render samples in the collapsed-stack format read by flamegraph tools."""
+    return "".join(f"{stack} {count}\n" for stack, count in samples.most_common())
+
+
+def top_functions(
+    samples: Counter, n: int = PROFILE_TOP_N
+) -> List[Tuple[str, float, float]]:
+    """Return ``(function, self %, total %)`` for the ``n`` hottest functions."""
+    total = sum(samples.values())
+    if not total:
+        return []
+    own: Counter = Counter()
+    inclusive: Counter = Counter()
+    for stack, count in samples.items():
+        frames = stack.split(";")
+        own[frames[-1]] += count
+        for label in set(frames):
+            inclusive[label] += count
+    return [
+        (label, 100 * count / total, 100 * inclusive[label] / total)
+        for label, count in own.most_common(n)
+    ]
+
+
+async def profile_event_loop(
+    seconds: float, interval: float = PROFILE_INTERVAL
+) -> Optional[Counter]:
+    """Sample the running event loop for ``seconds``.
+
+    Returns ``None`` if another profile is already in progress.
+    """
+    if not _profile_lock.acquire(blocking=False):
+        return None
+    try:
+        profiler = SamplingProfiler(threading.get_ident(), interval)
+        profiler.start()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            samples = profiler.stop()
+        return samples
+    finally:
+        _profile_lock.release()
+
+
+async def send_profile(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Job callback that profiles the loop and sends the results to the admin."""
+    job = context.job
+    if job is None or job.data is None or job.chat_id is None:
+        return
+    job_data = cast(Dict[str, Any], job.data)
+    seconds = job_data["seconds"]
+    chat_id = job.chat_id
+    samples = await profile_event_loop(seconds)
+    if samples is None:
+        await context.bot.send_message(
+            chat_id=chat_id, text="A profile is already running."
+        )
+        return
+    total = sum(samples.values())
+    filename = f"profile-{datetime.utcnow().strftime('%Y%m%dT%H%M%S')}.collapsed"
+    await context.bot.send_document(
+        chat_id=chat_id,
+        document=format_collapsed(samples).encode("utf-8"),
+        filename=filename,
+        caption=f"{total} samples over {seconds}s. Render with flamegraph.pl or speedscope.",
+    )
+    lines = [f"{'self%':>6} {'total%':>7}  function"]
+    lines += [
+        f"{own:6.1f} {incl:7.1f}  {label}"
+        for label, own, incl in top_functions(samples)
+    ]
+    await context.bot.send_message(chat_id=chat_id, text="\n".join(lines))
+
+
+class LoopWatchdog:
+    """Log the event loop thread's stack whenever the loop stops responding.
+
+    A heartbeat callback on the loop records when it last ran; a watchdog
+    thread notices when the heartbeat is late by more than ``threshold``
+    seconds and captures the stack of whatever is holding the loop.
+    """
+
+    def __init__(self, threshold: float = LOOP_BLOCK_THRESHOLD) -> None:
+        if threshold <= 0:
+            raise ValueError("`threshold` must be a positive number of seconds!")
+        self.threshold = threshold
+        self.interval = threshold / 4
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread_id = 0
+        self._last_beat = time.monotonic()
+        self._blocked_since: Optional[float] = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(
+            target=self._watch, name="loop-watchdog", daemon=True
+        )
+
+    def start(self) -> None:
+        """Start watching the running loop; call from the loop thread."""
+        self._loop = asyncio.get_running_loop()
+        self._thread_id = threading.get_ident()
+        self._beat()
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _beat(self) -> None:
+        now = time.monotonic()
+        if self._blocked_since is not None:
+            logging.warning(
+                "Event loop unblocked after %.2fs.", now - self._blocked_since
+            )
+            self._blocked_since = None
+        self._last_beat = now
+        if self._loop is not None and not self._stop.is_set():
+            self._loop.call_later(self.interval, self._beat)
+
+    def _watch(self) -> None:
+        while not self._stop.wait(self.interval):
+            late = time.monotonic() - self._last_beat - self.interval
+            if late <= self.threshold or self._blocked_since is not None:
+                continue
+            self._blocked_since = self._last_beat + self.interval
+            frame = sys._current_frames().get(self._thread_id)
+            stack = (
+                "".join(traceback.format_stack(frame)) if frame else "<unavailable>\n"
+            )
+            logging.warning(
+                "Event loop blocked for more than %.2fs; loop thread stack:\n%s",
+                self.threshold,
+                stack,
+            )
+
+
+_watchdog: Optional[LoopWatchdog] = None
+
+
+async def _start_watchdog(context: ContextTypes.DEFAULT_TYPE) -> None:
+    global _watchdog
+    if _watchdog is None:
+        _watchdog = LoopWatchdog()
+        _watchdog.start()
+
+
+def watch_event_loop(job_queue: JobQueue) -> None:
+    """Start the loop-blocking detector once the application is running."""
+    job_queue.run_once(_start_watchdog, when=0, name="loop_watchdog")
@@ -1,14 +1,52 @@
 import logging
+import os
 import sqlite3
 from datetime import datetime, time, timedelta
 from zoneinfo import ZoneInfo
 
+from telegram.constants import ChatAction
+from telegram.error import (
+    BadRequest,
+    Forbidden,
+    NetworkError,
+    RetryAfter,
+    TelegramError,
+    TimedOut,
+)
 from telegram.ext import ContextTypes, JobQueue
-from typing import Any, Dict, List, cast
+from typing import Any, Dict, List, Optional, cast
 
 from .paths import DB_PATH
-from .story import generate_text
-from .db import get_user_data, update_user
+from .story import GENERATION_FAILED_TEXT, choose_topic, generate_text
+from .db import (
+    get_user_data,
+    update_user,
+    add_dead_letter,
+    get_dead_letters,
+    update_dead_letter,
+    claim_dead_letter,
+    archive_story,
+    get_recent_topics,
+    purge_archived_stories,
+)
+from .tracing import SLOW_DELIVERY_SECONDS, current_trace, record_span, traced
+
+# BadRequest messages meaning the chat can never be reached again
+PERMANENT_ERROR_MESSAGES = (
+    "chat not found",
+    "user is deactivated",
+    "peer_id_invalid",
+    "bot was blocked",
+)
+# Retry schedule for transient failures: 1, 2, 4, 8, 16 minutes, then give up
+DEAD_LETTER_MAX_ATTEMPTS = 5
+DEAD_LETTER_BASE_DELAY = 60
+DEAD_LETTER_MAX_DELAY = 6 * 3600
+DEAD_LETTER_POLL_INTERVAL = 60
+# Archived stories older than this many days are deleted
+STORY_RETENTION_DAYS = int(os.getenv("STORY_RETENTION_DAYS") or 30)
+# Number of a user's most recent topics excluded when picking a new one
+TOPIC_HISTORY = 30
 
 
 def load_all_users() -> List[Dict[str, Any]]:
@@ -48,6 +86,20 @@ def schedule_story_job(job_queue: JobQueue, user: Dict[str, Any]) -> datetime:
             next_run_time += timedelta(days=1)
     return next_run_time
 
+
+def _last_fire_time(user: Dict[str, Any]) -> datetime:
+    """Return the most recent scheduled delivery time for ``user``."""
+    tz = ZoneInfo(user["timezone"])
+    now = datetime.now(tz)
+    fire_time = now.replace(
+        hour=user["delivery_hour"], minute=0, second=0, microsecond=0
+    )
+    if fire_time > now:
+        fire_time -= timedelta(days=1)
+    return fire_time
+
+
+@traced("send_story", slow_threshold=SLOW_DELIVERY_SECONDS)
 async def send_story(context: ContextTypes.DEFAULT_TYPE) -> None:
     """Generate and send a story to the user associated with the job."""
 
@@ -60,14 +112,219 @@ async def send_story(context: ContextTypes.DEFAULT_TYPE) -> None:
     if not user:
         return
 
-    story_text = await generate_text(user["language"], user["level"])
-    await context.bot.send_message(chat_id=user_id, text=story_text)
+    trace = current_trace()
+    if (
+        trace is not None
+        and user.get("delivery_hour") is not None
+        and user.get("timezone")
+    ):
+        # Time between the scheduled fire time and the callback starting
+        fire_ns = int(_last_fire_time(user).timestamp() * 1e9)
+        record_span("job.fire", fire_ns, trace.root.start_ns)
+
+    story_text: Optional[str] = None
+    topic: Optional[str] = None
+    try:
+        # Cheap reachability probe so blocked chats don't cost a generation
+        await context.bot.send_chat_action(chat_id=user_id, action=ChatAction.TYPING)
+        topic = choose_topic(get_recent_topics(user_id, TOPIC_HISTORY))
+        story_text = await generate_text(user["language"], user["level"], topic)
+        await context.bot.send_message(chat_id=user_id, text=story_text)
+    except TelegramError as e:
+        handle_delivery_failure(context.job_queue, user_id, story_text, e, topic)
+        return
+    timestamp = datetime.utcnow().isoformat()
+    update_user(user_id, last_sent=timestamp)
+    if story_text != GENERATION_FAILED_TEXT:
+        archive_story(
+            user_id, story_text, timestamp, topic, user["language"], user["level"]
+        )
+
+
+def is_permanent_failure(error: TelegramError) -> bool:
+    """Return ``True`` if ``error`` means the user can no longer be reached."""
+    if isinstance(error, Forbidden):
+        return True
+    if isinstance(error, BadRequest):
+        message = error.message.lower()
+        return any(m in message for m in PERMANENT_ERROR_MESSAGES)
+    return False
+
+
+def is_retryable_failure(error: TelegramError) -> bool:
+    """Return ``True`` if sending the same request again may succeed.
+
+    Rate limits, timeouts, connection errors and 5xx responses are transient.
+    Any other ``BadRequest`` (e.g. "message is too long") fails the same way
+    on every attempt.
+    """
+    if isinstance(error, RetryAfter):
+        return True
+    # BadRequest subclasses NetworkError but is never transient
+    return isinstance(error, NetworkError) and not isinstance(error, BadRequest)
+
+
+def dead_letter_status(error: TelegramError, message_sent: bool) -> str:
+    """Return the dead-letter status for a delivery that failed with ``error``.
+
+    ``message_sent`` says whether ``error`` came from sending the story itself.
+    A timeout there is ambiguous, as Telegram may have delivered the message,
+    so it is not retried automatically to avoid sending the story twice.
+    """
+    if message_sent and isinstance(error, TimedOut):
+        return "unconfirmed"
+    if is_retryable_failure(error):
+        return "pending"
+    return "failed"
+
+
+def retry_delay(attempts: int, error: TelegramError) -> float:
+    """Return the backoff in seconds before retry number ``attempts + 1``."""
+    delay = min(DEAD_LETTER_BASE_DELAY * 2**attempts, DEAD_LETTER_MAX_DELAY)
+    if isinstance(error, RetryAfter):
+        delay = max(delay, float(error.retry_after))
+    return delay
+
+
+def pause_user(job_queue: Optional[JobQueue], user_id: int) -> None:
+    """Mark ``user_id`` as paused and remove their scheduled story job."""
+    update_user(user_id, paused=1)
+    if job_queue is None:
+        return
+    for job in job_queue.get_jobs_by_name(str(user_id)):
+        job.schedule_removal()
+
+
+def handle_delivery_failure(
+    job_queue: Optional[JobQueue],
+    user_id: int,
+    story_text: Optional[str],
+    error: TelegramError,
+    topic: Optional[str] = None,
+) -> None:
+    """Pause unreachable users and record other failures as dead letters.
+
+    A story is generated before it is sent, so ``story_text`` is set exactly
+    when ``error`` came from sending it.
+    """
+    if is_permanent_failure(error):
+        logging.warning(
+            f"Pausing user_id {user_id}, delivery failed permanently: {error}"
+        )
+        pause_user(job_queue, user_id)
+        return
+    status = dead_letter_status(error, message_sent=story_text is not None)
+    logging.warning(
+        f"Delivery to user_id {user_id} failed, queued as {status}: {error}"
+    )
+    next_attempt = datetime.utcnow() + timedelta(seconds=retry_delay(0, error))
+    add_dead_letter(
+        user_id, story_text, str(error), next_attempt.isoformat(), topic, status
+    )
+
+
+async def replay_dead_letter(
+    context: ContextTypes.DEFAULT_TYPE, entry: Dict[str, Any]
+) -> bool:
+    """Try to deliver a dead-letter entry and record the outcome.
+
+    The entry is claimed first, so concurrent replays of the same entry (the
+    retry job and ``/replay``) deliver it at most once.
+    """
+    entry_id = entry["id"]
+    user_id = entry["user_id"]
+    if not claim_dead_letter(entry_id):
+        logging.info(f"Dead letter {entry_id} is already being replayed or delivered.")
+        return False
+    attempts = entry["attempts"] + 1
+    story_text = entry["story_text"]
+    topic = entry.get("topic")
+    _, user = get_user_data(user_id)
+    if not user or user["paused"]:
+        reason = "user not found" if not user else "user paused"
+        update_dead_letter(entry_id, status="failed", attempts=attempts, error=reason)
+        return False
+    try:
+        if story_text is None:
+            # The original failure happened before a story was generated
+            topic = choose_topic(get_recent_topics(user_id, TOPIC_HISTORY))
+            story_text = await generate_text(user["language"], user["level"], topic)
+            update_dead_letter(entry_id, story_text=story_text, topic=topic)
+        await context.bot.send_message(chat_id=user_id, text=story_text)
+    except TelegramError as e:
+        if is_permanent_failure(e):
+            logging.warning(
+                f"Pausing user_id {user_id}, delivery failed permanently: {e}"
+            )
+            pause_user(context.job_queue, user_id)
+            status = "failed"
+        else:
+            # Only send_message raises TelegramError here
+            status = dead_letter_status(e, message_sent=True)
+        if status == "pending" and attempts >= DEAD_LETTER_MAX_ATTEMPTS:
+            logging.error(
+                f"Giving up on dead letter {entry_id} after {attempts} attempts: {e}"
+            )
+            status = "failed"
+        next_attempt: Optional[str] = None
+        if status == "pending":
+            delay = retry_delay(attempts, e)
+            next_attempt = (datetime.utcnow() + timedelta(seconds=delay)).isoformat()
+        update_dead_letter(
+            entry_id,
+            status=status,
+            attempts=attempts,
+            error=str(e),
+            next_attempt=next_attempt,
+        )
+        return False
+    except Exception:
+        # Don't leave the entry claimed; the retry job will pick it up again
+        update_dead_letter(entry_id, status="pending")
+        raise
+    update_dead_letter(entry_id, status="delivered", attempts=attempts)
     timestamp = datetime.utcnow().isoformat()
     update_user(user_id, last_sent=timestamp)
+    if story_text != GENERATION_FAILED_TEXT:
+        archive_story(
+            user_id, story_text, timestamp, topic, user["language"], user["level"]
+        )
+    logging.info(f"Delivered dead letter {entry_id} to user_id {user_id}.")
+    return True
+
+
+@traced("retry_dead_letters")
+async def retry_dead_letters(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Job callback that replays every dead-letter entry that is due."""
+    due = get_dead_letters(("pending",), due_before=datetime.utcnow().isoformat())
+    for entry in due or []:
+        await replay_dead_letter(context, entry)
+
+
+def schedule_dead_letter_retries(
+    job_queue: JobQueue, interval: float = DEAD_LETTER_POLL_INTERVAL
+) -> None:
+    """Poll the dead-letter queue every ``interval`` seconds."""
+    job_queue.run_repeating(
+        retry_dead_letters, interval=interval, first=interval, name="dead_letters"
+    )
+
+
+async def purge_story_archive(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Job callback that deletes stories past the retention period."""
+    cutoff = datetime.utcnow() - timedelta(days=STORY_RETENTION_DAYS)
+    purge_archived_stories(cutoff.isoformat())
+
+
+def schedule_archive_purge(job_queue: JobQueue) -> None:
+    """Purge the story archive once at startup and then daily."""
+    job_queue.run_repeating(
+        purge_story_archive, interval=timedelta(days=1), first=0, name="archive_purge"
+    )
 
 
 def restart_jobs(job_queue: JobQueue) -> None:
     """Reschedule story jobs for all active users."""
     for user in load_all_users():
         if user.get("delivery_hour") is not None and user.get("timezone"):
-            schedule_story_job(job_queue, user)
\ No newline at end of file
+            schedule_story_job(job_queue, user)
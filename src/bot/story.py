@@ -1,11 +1,12 @@
-import json
 import random
 import logging
+from typing import Iterable, Optional
 from dotenv import load_dotenv
 import os
 import openai
 from openai import AsyncOpenAI
-from .paths import CONFIG_PATH
+from .config import get_config
+from .tracing import timed
 
 load_dotenv()  # reads your .env into os.environ
 api_key = os.getenv("OPENAI_API_KEY")
@@ -15,29 +16,38 @@ if not api_key:
 openai.api_key = api_key
 client = AsyncOpenAI()
 
-with open(CONFIG_PATH, 'r', encoding="utf-8") as f:
-    _cfg = json.load(f)
+# Returned in place of a story when generation fails; never archived
+GENERATION_FAILED_TEXT = (
+    "Sorry, I couldn't generate a story right now. Please try again later."
+)
 
-def _random_topic() -> str:
-    """Return a random topic from the config."""
-    return random.choice(_cfg['topics'])
 
+def choose_topic(recent: Iterable[str] = ()) -> str:
+    """Return a random topic from the config, avoiding ``recent`` topics if possible."""
+    topics = get_config().topics
+    recent_set = set(recent)
+    candidates = [t for t in topics if t not in recent_set]
+    return random.choice(candidates or topics)
 
 
 
 
-async def generate_text(language: str, level: str) -> str:
+
+@timed("openai.generate_text")
+async def generate_text(language: str, level: str, topic: Optional[str] = None) -> str:
     """Generate a CEFR-level text in ``language``.
 
     Args:
         language: Target language for the story.
         level: Learner's CEFR level.
+        topic: Story topic; a random one is chosen if omitted.
 
     Returns:
-        The generated text or an error message if generation fails.
+        The generated text or ``GENERATION_FAILED_TEXT`` if generation fails.
     """
 
-    topic = _random_topic()
+    if topic is None:
+        topic = choose_topic()
 
     try:
         response = await client.responses.create(
@@ -52,7 +62,7 @@ async def generate_text(language: str, level: str) -> str:
         )
     except Exception:
         logging.exception("Failed to generate text")
-        return "Sorry, I couldn't generate a story right now. Please try again later."
+        return GENERATION_FAILED_TEXT
 
     logging.info(f"Here is a text in {level} level {language} about {topic}:")
     return response.output_text
@@ -0,0 +1,438 @@
+import asyncio
+import atexit
+import functools
+import json
+import logging
+import os
+import queue
+import secrets
+import threading
+import time
+import urllib.request
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple, TypeVar, cast
+
+from telegram import Update
+from telegram.request import HTTPXRequest, RequestData
+
+from pathlib import Path
+
+from .paths import SLOW_DELIVERY_LOG_PATH, TRACE_PATH
+
+SERVICE_NAME = "langbot"
+# Deliveries taking longer than this many seconds go to the slow-delivery log
+SLOW_DELIVERY_SECONDS = float(os.getenv("SLOW_DELIVERY_SECONDS") or 30)
+# Optional OTLP/HTTP collector, e.g. http://localhost:4318/v1/traces
+OTLP_ENDPOINT = os.getenv("OTEL_EXPORTER_OTLP_TRACES_ENDPOINT") or None
+
+# Finished traces waiting for export; new traces are dropped when full
+TRACE_QUEUE_SIZE = 1000
+# Traces written or posted together by the exporter thread
+TRACE_BATCH_SIZE = 100
+# Trace files are rotated at this size, keeping this many old files
+TRACE_MAX_BYTES = 10 * 1024 * 1024
+TRACE_BACKUP_COUNT = 3
+
+F = TypeVar("F", bound=Callable[..., Any])
+
+# OTLP status codes
+_STATUS_OK = 1
+_STATUS_ERROR = 2
+
+
+class Span:
+    """A single timed stage inside a :class:`Trace`."""
+
+    __slots__ = (
+        "name",
+        "span_id",
+        "parent_id",
+        "attributes",
+        "start_ns",
+        "end_ns",
+        "error",
+    )
+
+    def __init__(
+        self,
+        name: str,
+        parent_id: Optional[str],
+        attributes: Dict[str, Any],
+        start_ns: Optional[int] = None,
+    ) -> None:
+        self.name = name
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.attributes = attributes
+        self.start_ns = start_ns if start_ns is not None else time.time_ns()
+        self.end_ns: Optional[int] = None
+        self.error: Optional[str] = None
+
+    def end(self, end_ns: Optional[int] = None) -> None:
+        """Mark the span as finished."""
+        if self.end_ns is None:
+            self.end_ns = end_ns if end_ns is not None else time.time_ns()
+
+    @property
+    def duration_ms(self) -> float:
+        end_ns = self.end_ns if self.end_ns is not None else time.time_ns()
+        return (end_ns - self.start_ns) / 1e6
+
+    def to_otlp(self, trace_id: str) -> Dict[str, Any]:
+        """Return the span in OTLP/JSON form."""
+        data: Dict[str, Any] = {
+            "traceId": trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": 1,  # SPAN_KIND_INTERNAL
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns or self.start_ns),
+            "attributes": _otlp_attributes(self.attributes),
+            "status": {"code": _STATUS_OK},
+        }
+        if self.parent_id:
+            data["parentSpanId"] = self.parent_id
+        if self.error:
+            data["status"] = {"code": _STATUS_ERROR, "message": self.error}
+        return data
+
+
+class Trace:
+    """All spans recorded while processing one update or job run."""
+
+    def __init__(self, name: str, attributes: Dict[str, Any]) -> None:
+        self.trace_id = secrets.token_hex(16)
+        self.root = Span(name, None, attributes)
+        self.spans: List[Span] = [self.root]
+
+    def start_span(
+        self,
+        name: str,
+        parent: Optional[Span],
+        attributes: Dict[str, Any],
+        start_ns: Optional[int] = None,
+    ) -> Span:
+        """Open a child span of ``parent`` (or the root span)."""
+        span_ = Span(name, (parent or self.root).span_id, attributes, start_ns)
+        self.spans.append(span_)
+        return span_
+
+    @property
+    def duration_s(self) -> float:
+        """Seconds from the earliest span start to the end of the root span."""
+        start_ns = min(s.start_ns for s in self.spans)
+        end_ns = self.root.end_ns or time.time_ns()
+        return (end_ns - start_ns) / 1e9
+
+    def breakdown(self) -> List[Tuple[str, float]]:
+        """Return ``(name, milliseconds)`` for every non-root span in start order."""
+        children = sorted(self.spans[1:], key=lambda s: s.start_ns)
+        return [(s.name, round(s.duration_ms, 1)) for s in children]
+
+    def to_otlp(self) -> Dict[str, Any]:
+        """Return the trace as an OTLP/JSON ``ExportTraceServiceRequest``."""
+        return {
+            "resourceSpans": [
+                {
+                    "resource": {
+                        "attributes": _otlp_attributes({"service.name": SERVICE_NAME})
+                    },
+                    "scopeSpans": [
+                        {
+                            "scope": {"name": "bot.tracing"},
+                            "spans": [s.to_otlp(self.trace_id) for s in self.spans],
+                        }
+                    ],
+                }
+            ]
+        }
+
+
+def _otlp_attributes(attributes: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Convert a flat mapping into OTLP ``KeyValue`` entries."""
+    result = []
+    for key, value in attributes.items():
+        if isinstance(value, bool):
+            typed: Dict[str, Any] = {"boolValue": value}
+        elif isinstance(value, int):
+            typed = {"intValue": str(value)}
+        elif isinstance(value, float):
+            typed = {"doubleValue": value}
+        else:
+            typed = {"stringValue": str(value)}
+        result.append({"key": key, "value": typed})
+    return result
+
+
+_current_trace: ContextVar[Optional[Trace]] = ContextVar("current_trace", default=None)
+_current_span: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+
+
+def current_trace() -> Optional[Trace]:
+    """Return the trace active in the current task, if any."""
+    return _current_trace.get()
+
+
+@contextmanager
+def span(name: str, **attributes: Any) -> Iterator[Optional[Span]]:
+    """Time the enclosed block as a child span of the active trace.
+
+    Outside of a trace this is a no-op and yields ``None``.
+    """
+    trace = _current_trace.get()
+    if trace is None:
+        yield None
+        return
+    span_ = trace.start_span(name, _current_span.get(), attributes)
+    token = _current_span.set(span_)
+    try:
+        yield span_
+    except BaseException as e:
+        span_.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        _current_span.reset(token)
+        span_.end()
+
+
+def record_span(name: str, start_ns: int, end_ns: int, **attributes: Any) -> None:
+    """Add an already-measured span to the active trace, if any."""
+    trace = _current_trace.get()
+    if trace is None:
+        return
+    trace.start_span(name, _current_span.get(), attributes, start_ns).end(end_ns)
+
+
+def timed(name: str) -> Callable[[F], F]:
+    """Decorate a sync or async function so each call is recorded as a span."""
+
+    def decorator(func: F) -> F:
+        if asyncio.iscoroutinefunction(func):
+
+            @functools.wraps(func)
+            async def async_wrapper(*args: Any, **kwargs: Any) -> Any:
+                with span(name):
+                    return await func(*args, **kwargs)
+
+            return cast(F, async_wrapper)
+
+        @functools.wraps(func)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            with span(name):
+                return func(*args, **kwargs)
+
+        return cast(F, wrapper)
+
+    return decorator
+
+
+def _root_attributes(args: Tuple[Any, ...]) -> Dict[str, Any]:
+    """Extract identifying attributes from handler or job callback arguments."""
+    attributes: Dict[str, Any] = {}
+    if args and isinstance(args[0], Update):
+        update = args[0]
+        attributes["telegram.update_id"] = update.update_id
+        if update.effective_user:
+            attributes["telegram.user_id"] = update.effective_user.id
+    context = args[-1] if args else None
+    job = getattr(context, "job", None)
+    if job is not None:
+        attributes["job.name"] = job.name
+    return attributes
+
+
+def traced(name: str, slow_threshold: Optional[float] = None) -> Callable[[F], F]:
+    """Run an async handler or job callback inside a new trace.
+
+    The finished trace is handed to the background exporter; if
+    ``slow_threshold`` seconds is given and exceeded, the trace is also written
+    to the slow-delivery log.
+    """
+
+    def decorator(func: F) -> F:
+        @functools.wraps(func)
+        async def wrapper(*args: Any, **kwargs: Any) -> Any:
+            trace = Trace(name, _root_attributes(args))
+            trace_token = _current_trace.set(trace)
+            span_token = _current_span.set(trace.root)
+            try:
+                return await func(*args, **kwargs)
+            except BaseException as e:
+                trace.root.error = f"{type(e).__name__}: {e}"
+                raise
+            finally:
+                _current_span.reset(span_token)
+                _current_trace.reset(trace_token)
+                trace.root.end()
+                _exporter.submit(trace, slow_threshold)
+
+        return cast(F, wrapper)
+
+    return decorator
+
+
+def _rotate(path: Path) -> None:
+    """Rotate ``path`` to ``path.1`` (and so on) once it exceeds the size cap."""
+    try:
+        if os.path.getsize(path) < TRACE_MAX_BYTES:
+            return
+    except OSError:
+        return
+    for i in range(TRACE_BACKUP_COUNT - 1, 0, -1):
+        older = Path(f"{path}.{i}")
+        if older.exists():
+            os.replace(older, f"{path}.{i + 1}")
+    os.replace(path, f"{path}.1")
+
+
+def _append_lines(path: Path, lines: List[str]) -> None:
+    """Append ``lines`` to ``path``, rotating it first if it is too large."""
+    _rotate(path)
+    with open(path, "a", encoding="utf-8") as f:
+        f.write("".join(line + "\n" for line in lines))
+
+
+class TraceExporter:
+    """Export finished traces from a background thread.
+
+    Handlers only enqueue; one worker thread drains the bounded queue in
+    batches and writes them to the collector if one is configured, or to the
+    rotating trace file otherwise. Slow deliveries are logged from the worker
+    as well.
+    """
+
+    def __init__(self) -> None:
+        self._queue: "queue.Queue[Optional[Tuple[Trace, Optional[float]]]]" = (
+            queue.Queue(TRACE_QUEUE_SIZE)
+        )
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self.dropped = 0
+
+    def submit(self, trace: Trace, slow_threshold: Optional[float] = None) -> None:
+        """Queue ``trace`` for export without blocking."""
+        self._ensure_started()
+        try:
+            self._queue.put_nowait((trace, slow_threshold))
+        except queue.Full:
+            self.dropped += 1
+            if self.dropped % TRACE_QUEUE_SIZE == 1:
+                logging.warning(f"Trace queue full, dropped {self.dropped} trace(s).")
+
+    def flush(self, timeout: float = 5) -> None:
+        """Stop the worker after it has exported everything queued."""
+        if self._thread is None:
+            return
+        try:
+            self._queue.put(None, timeout=timeout)
+        except queue.Full:
+            return
+        self._thread.join(timeout)
+
+    def _ensure_started(self) -> None:
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="trace-exporter", daemon=True
+                )
+                self._thread.start()
+                atexit.register(self.flush)
+
+    def _run(self) -> None:
+        while True:
+            item = self._queue.get()
+            batch = [item]
+            while item is not None and len(batch) < TRACE_BATCH_SIZE:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                batch.append(item)
+            entries = [entry for entry in batch if entry is not None]
+            if entries:
+                self._export(entries)
+            if len(entries) != len(batch):
+                return
+
+    def _export(self, entries: List[Tuple[Trace, Optional[float]]]) -> None:
+        traces = [trace for trace, _ in entries]
+        if OTLP_ENDPOINT:
+            _post_traces(traces)
+        else:
+            try:
+                _append_lines(
+                    TRACE_PATH,
+                    [json.dumps(t.to_otlp(), ensure_ascii=False) for t in traces],
+                )
+            except Exception as e:
+                logging.error(f"Error writing {len(traces)} trace(s): {e}")
+        for trace, slow_threshold in entries:
+            if slow_threshold is not None and trace.duration_s > slow_threshold:
+                _log_slow_delivery(trace, slow_threshold)
+
+
+def _post_traces(traces: List[Trace]) -> None:
+    """Send ``traces`` to the OTLP collector as one export request."""
+    resource_spans = [rs for t in traces for rs in t.to_otlp()["resourceSpans"]]
+    payload = json.dumps({"resourceSpans": resource_spans}, ensure_ascii=False)
+    try:
+        req = urllib.request.Request(
+            cast(str, OTLP_ENDPOINT),
+            data=payload.encode("utf-8"),
+            headers={"Content-Type": "application/json"},
+            method="POST",
+        )
+        with urllib.request.urlopen(req, timeout=5):
+            pass
+    except Exception as e:
+        logging.error(f"Error exporting {len(traces)} trace(s) to collector: {e}")
+
+
+_exporter = TraceExporter()
+
+
+def _log_slow_delivery(trace: Trace, threshold: float) -> None:
+    """Append a slow trace and its span breakdown to the slow-delivery log."""
+    record = {
+        "trace_id": trace.trace_id,
+        "name": trace.root.name,
+        "attributes": trace.root.attributes,
+        "duration_s": round(trace.duration_s, 3),
+        "threshold_s": threshold,
+        "error": trace.root.error,
+        "spans": [{"name": n, "ms": ms} for n, ms in trace.breakdown()],
+    }
+    logging.warning(
+        "Slow delivery %s took %.1fs (threshold %.1fs): %s",
+        trace.trace_id,
+        trace.duration_s,
+        threshold,
+        ", ".join(f"{n}={ms}ms" for n, ms in trace.breakdown()),
+    )
+    try:
+        _append_lines(SLOW_DELIVERY_LOG_PATH, [json.dumps(record, ensure_ascii=False)])
+    except Exception as e:
+        logging.error(f"Error writing slow delivery log: {e}")
+
+
+class TracedRequest(HTTPXRequest):
+    """HTTPX request backend that records every Bot API call as a span."""
+
+    async def do_request(
+        self,
+        url: str,
+        method: str,
+        request_data: Optional[RequestData] = None,
+        *args: Any,
+        **kwargs: Any,
+    ) -> Tuple[int, bytes]:
+        with span(f"telegram.{url.rsplit('/', 1)[-1]}") as span_:
+            code, payload = await super().do_request(
+                url, method, request_data, *args, **kwargs
+            )
+            if span_ is not None:
+                span_.attributes["http.status_code"] = code
+            return code, payload
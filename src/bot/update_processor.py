@@ -0,0 +1,75 @@
+import asyncio
+import os
+from typing import Any, Awaitable, Dict, Optional
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+# Updates processed at the same time across all chats; 1 disables concurrency.
+# This helps only while handlers wait on Telegram/OpenAI: with a zero-latency
+# fake Bot API, 32 is ~0.6x the sequential throughput and raises p50 loop lag
+# from ~0.6 ms to ~10 ms, while at 50 ms API latency it is ~8x faster.
+MAX_CONCURRENT_UPDATES = int(os.getenv("MAX_CONCURRENT_UPDATES") or 32)
+# Upper bound on updates admitted by PTB before they wait on their chat
+MAX_PENDING_UPDATES = 10_000
+
+
+def _chat_key(update: object) -> Optional[int]:
+    """Return the id whose updates must be processed in order, if any."""
+    if not isinstance(update, Update):
+        return None
+    if update.effective_chat is not None:
+        return update.effective_chat.id
+    if update.effective_user is not None:
+        return update.effective_user.id
+    return None
+
+
+class ChatOrderedUpdateProcessor(BaseUpdateProcessor):
+    """Process updates from different chats concurrently, one chat at a time.
+
+    Each chat has a lock acquired in arrival order, so a chat's updates are
+    handled sequentially and the ``ConversationHandler`` state machine sees
+    them in order. The concurrency cap is applied only after the chat lock is
+    held; updates queued behind a busy chat don't occupy any of the
+    ``concurrency_limit`` slots. PTB's ``max_concurrent_updates`` therefore
+    reports the much larger bound on admitted updates.
+    """
+
+    def __init__(self, max_concurrent_updates: int = MAX_CONCURRENT_UPDATES) -> None:
+        if max_concurrent_updates < 1:
+            raise ValueError("`max_concurrent_updates` must be a positive integer!")
+        # PTB's own semaphore is acquired before do_process_update, so keep it
+        # loose and enforce the real limit below
+        super().__init__(max(MAX_PENDING_UPDATES, max_concurrent_updates))
+        self.concurrency_limit = max_concurrent_updates
+        self._running = asyncio.BoundedSemaphore(max_concurrent_updates)
+        self._chat_locks: Dict[int, asyncio.Lock] = {}
+        self._chat_waiters: Dict[int, int] = {}
+
+    async def do_process_update(
+        self, update: object, coroutine: Awaitable[Any]
+    ) -> None:
+        key = _chat_key(update)
+        if key is None:
+            async with self._running:
+                await coroutine
+            return
+        lock = self._chat_locks.setdefault(key, asyncio.Lock())
+        self._chat_waiters[key] = self._chat_waiters.get(key, 0) + 1
+        try:
+            async with lock:
+                async with self._running:
+                    await coroutine
+        finally:
+            self._chat_waiters[key] -= 1
+            if not self._chat_waiters[key]:
+                # Drop idle chats so the dicts don't grow with every user
+                del self._chat_waiters[key]
+                del self._chat_locks[key]
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass